@@ -1,12 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import joblib
 import pandas as pd
 import numpy as np
 import warnings
 import os
+import json
+import time
 from datetime import datetime
 
+import jobs
+import monitoring
+import shadow
+
 # TabNet availability check - imports are deferred to avoid DLL issues
 TABNET_AVAILABLE = False
 TabNetRegressor = None
@@ -39,15 +45,163 @@ warnings.filterwarnings("ignore")
 app = Flask(__name__)
 CORS(app)
 
+# Inference backend: 'native' (sklearn/XGBoost/TabNet objects) or 'onnx' (ONNX Runtime, CPU)
+INFERENCE_BACKEND = os.environ.get('GREENLOOP_INFERENCE_BACKEND', 'native').lower()
+ONNX_MODEL_PATH = os.environ.get('GREENLOOP_ONNX_MODEL', 'model/ensemble.onnx')
+ONNX_INTRA_OP_THREADS = int(os.environ.get('GREENLOOP_ONNX_THREADS', '1'))
+
+# Asynchronous scoring jobs (see jobs.py)
+JOBS_DIR = os.environ.get('GREENLOOP_JOBS_DIR', 'jobs')
+JOB_WORKERS = int(os.environ.get('GREENLOOP_JOB_WORKERS', '2'))
+JOB_CHUNK_ROWS = int(os.environ.get('GREENLOOP_JOB_CHUNK_ROWS', '50000'))
+
+# Drift monitoring (see monitoring.py)
+DRIFT_BASELINE_PATH = os.environ.get('GREENLOOP_DRIFT_BASELINE', monitoring.DEFAULT_BASELINE_PATH)
+MONITOR_STATE_DIR = os.environ.get('GREENLOOP_MONITOR_DIR', 'monitoring_state')
+
+# Shadow / canary evaluation of a candidate ensemble (see shadow.py); disabled unless a candidate is set
+CANDIDATE_MODELS_PATH = os.environ.get('GREENLOOP_CANDIDATE_MODELS')
+CANDIDATE_TABNET_PATH = os.environ.get('GREENLOOP_CANDIDATE_TABNET', 'model/tabnet_model.zip')
+CANDIDATE_PREPROCESSING_PATH = os.environ.get('GREENLOOP_CANDIDATE_PREPROCESSING')
+CANDIDATE_WEIGHTS = os.environ.get('GREENLOOP_CANDIDATE_WEIGHTS')  # JSON, e.g. '{"XGBoost": 0.55, "Random Forest": 0.35, "TabNet": 0.1}'
+SHADOW_MODE = os.environ.get('GREENLOOP_SHADOW_MODE', shadow.SHADOW).lower()
+SHADOW_SAMPLE_RATE = float(os.environ.get('GREENLOOP_SHADOW_SAMPLE_RATE', '0.1'))
+CANARY_PERCENT = float(os.environ.get('GREENLOOP_CANARY_PERCENT', '0'))
+SHADOW_MAX_ADDED_P99_MS = float(os.environ.get('GREENLOOP_SHADOW_MAX_ADDED_P99_MS', '5'))
+
 # Global variables
 models = None
 preprocessing = None
 model_info = None
 ensemble_weights = None
+inference_backend = 'native'
+onnx_session = None
+onnx_members = []
+job_queue = None
+drift_monitor = None
+candidate_models = None
+candidate_preprocessing = None
+candidate_weights = None
+shadow_evaluator = None
+
+def create_onnx_session(model_path, intra_op_threads=ONNX_INTRA_OP_THREADS):
+    """Create a CPU ONNX Runtime session for the exported ensemble (see export_onnx.py)"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+def onnx_feed(session, input_df):
+    """Build the ONNX Runtime feed (one [N, 1] tensor per raw column, in training order)"""
+    feed = {}
+    # skl2onnx sanitises input names ('Unnamed: 0' -> 'Unnamed__0'), so match by position
+    for graph_input, col in zip(session.get_inputs(), input_df.columns):
+        values = input_df[[col]].to_numpy()
+        if graph_input.type == 'tensor(string)':
+            feed[graph_input.name] = values.astype(str).astype(object)
+        elif graph_input.type == 'tensor(double)':
+            feed[graph_input.name] = values.astype(np.float64)
+        else:
+            feed[graph_input.name] = values.astype(np.float32)
+    return feed
+
+def onnx_bundle_mismatch(members, weights, tolerance=1e-5):
+    """Describe how an exported graph differs from the loaded models/weights (None if it matches)
+
+    Loaded models may be absent from the graph only if their ensemble weight is
+    zero (skipped with export_onnx.py --allow-missing); they don't affect the prediction.
+    """
+    unknown = [name for name in members if name not in models]
+    if unknown:
+        return f"graph members {unknown} are not loaded models {list(models.keys())}"
+    absent = [name for name in models if name not in members]
+    weights_by_name = ensemble_weights or {}
+    weighted_absent = [name for name in absent if weights_by_name.get(name, 0.0) > 0]
+    # With no positive weights the native path averages every model, so nothing may be absent
+    if absent and (weighted_absent or sum(weights_by_name.values()) <= 0):
+        return f"graph is missing weighted models {weighted_absent or absent}"
+    if absent:
+        print(f"⚠️ ONNX graph omits zero-weight models {absent}")
+    if len(weights) != len(members):
+        return "graph has no ensemble weights metadata"
+    
+    # Same normalisation as export_onnx.build_ensemble_onnx
+    expected = np.array([(ensemble_weights or {}).get(name, 0.0) for name in members], dtype=np.float64)
+    if expected.sum() <= 0:
+        expected = np.ones(len(members))
+    expected = expected / expected.sum()
+    if np.max(np.abs(expected - np.array(weights))) > tolerance:
+        return (f"graph weights {dict(zip(members, weights))} != "
+                f"ensemble weights {dict(zip(members, expected.round(6).tolist()))}")
+    return None
+
+def load_onnx_backend(model_path=ONNX_MODEL_PATH, intra_op_threads=ONNX_INTRA_OP_THREADS):
+    """Load the exported ONNX ensemble; returns False (keeping the native backend) on failure"""
+    global onnx_session, onnx_members
+    if not os.path.exists(model_path):
+        print(f"⚠️ ONNX model not found: {model_path} (run: python export_onnx.py)")
+        return False
+    try:
+        session = create_onnx_session(model_path, intra_op_threads)
+        metadata = session.get_modelmeta().custom_metadata_map
+        members = json.loads(metadata.get('members', '[]'))
+        weights = json.loads(metadata.get('weights', '[]'))
+        mismatch = onnx_bundle_mismatch(members, weights)
+        if mismatch:
+            print(f"⚠️ ONNX model {model_path} does not match the loaded models: {mismatch}")
+            print("   Re-export with: python export_onnx.py")
+            return False
+        onnx_members = members
+        onnx_session = session
+        print(f"✅ Loaded ONNX ensemble from: {model_path} "
+              f"(members: {onnx_members}, intra-op threads: {intra_op_threads})")
+        return True
+    except ImportError as e:
+        print(f"⚠️ ONNX Runtime not available: {e}")
+        print("   Install with: pip install onnxruntime")
+        return False
+    except Exception as e:
+        print(f"⚠️ Failed to load ONNX model {model_path}: {e}")
+        return False
 
-def load_models():
-    """Load ensemble model and preprocessing components"""
+def load_ensemble_file(model_file, tabnet_path="model/tabnet_model.zip"):
+    """Load a joblib ensemble dict; returns (models, tabnet_loaded)"""
+    loaded_models = joblib.load(model_file)
+    tabnet_loaded = False
+    
+    # Handle TabNet separately since it can't be pickled normally
+    loaded = {}
+    for name, model in loaded_models.items():
+        if name == 'TabNet' and TABNET_AVAILABLE and TabNetRegressor:
+            # Load TabNet from separate file
+            if os.path.exists(tabnet_path):
+                try:
+                    tabnet_model = TabNetRegressor()
+                    tabnet_model.load_model(tabnet_path)
+                    loaded[name] = tabnet_model
+                    tabnet_loaded = True
+                    print(f"✅ Loaded TabNet from: {tabnet_path}")
+                except Exception as e:
+                    print(f"⚠️ Failed to load TabNet: {e}")
+            else:
+                print(f"⚠️ TabNet file not found: {tabnet_path}")
+        else:
+            loaded[name] = model
+    
+    return loaded, tabnet_loaded
+
+def load_models(backend=None):
+    """Load ensemble model and preprocessing components
+
+    backend selects the inference path: 'native' (default) or 'onnx'. When
+    omitted, GREENLOOP_INFERENCE_BACKEND is used.
+    """
     global models, preprocessing, model_info, ensemble_weights, TABNET_AVAILABLE
+    global inference_backend, onnx_session
     try:
         print("🚀 Loading Ensemble Models...")
         
@@ -70,27 +224,7 @@ def load_models():
         for model_file in model_files:
             if os.path.exists(model_file):
                 try:
-                    loaded_models = joblib.load(model_file)
-                    
-                    # Handle TabNet separately since it can't be pickled normally
-                    models = {}
-                    for name, model in loaded_models.items():
-                        if name == 'TabNet' and TABNET_AVAILABLE and TabNetRegressor:
-                            # Load TabNet from separate file
-                            tabnet_path = "model/tabnet_model.zip"
-                            if os.path.exists(tabnet_path):
-                                try:
-                                    tabnet_model = TabNetRegressor()
-                                    tabnet_model.load_model(tabnet_path)
-                                    models[name] = tabnet_model
-                                    tabnet_loaded = True
-                                    print(f"✅ Loaded TabNet from: {tabnet_path}")
-                                except Exception as e:
-                                    print(f"⚠️ Failed to load TabNet: {e}")
-                            else:
-                                print(f"⚠️ TabNet file not found: {tabnet_path}")
-                        else:
-                            models[name] = model
+                    models, tabnet_loaded = load_ensemble_file(model_file)
                     
                     print(f"✅ Loaded base models from: {model_file}")
                     models_loaded = True
@@ -202,12 +336,152 @@ def load_models():
                     print(f"   {name}: {score:.4f}")
         
         print(f"⚖️ Ensemble weights: {ensemble_weights}")
+
+        # Select inference backend; fall back to native objects if ONNX can't be used
+        requested_backend = (backend or INFERENCE_BACKEND).lower()
+        inference_backend = 'native'
+        onnx_session = None
+        if requested_backend == 'onnx':
+            if preprocessing and 'standard_preprocessor' in preprocessing and load_onnx_backend():
+                inference_backend = 'onnx'
+            else:
+                print("⚠️ ONNX backend unavailable, using native models")
+        elif requested_backend != 'native':
+            print(f"⚠️ Unknown inference backend '{requested_backend}', using native models")
+        print(f"⚙️ Inference backend: {inference_backend}")
         return True
         
     except Exception as e:
         print(f"❌ Error loading models: {e}")
         return False
 
+# Map frontend process types to the categories known by the Prototype3 preprocessing pipeline
+PROCESS_TYPE_MAP = {
+    'shredding': 'shredding',
+    'separation': 'separation',
+    'melting': 'melting',
+    'pyrolysis': 'pyrolysis',
+    'chemical': 'chemical',
+    'recycling': 'recycling',
+    'composting': 'composting',
+    'production': 'production',
+    'recovery': 'metal_recovery',  # Map recovery to metal_recovery
+    'treatment': 'c-si_treatment',  # Map treatment to c-si_treatment
+    'incineration': 'incineration',
+    'landfill': 'landfill',
+    # Legacy mappings
+    'cement': 'production',
+    'steel': 'production', 
+    'aluminum': 'recycling',
+    'plastic': 'plastic_recovery_processing',
+    'glass': 'glass_recovery'
+}
+
+# Raw input columns of standard_preprocessor (training order) and their defaults
+STANDARD_INPUT_DEFAULTS = {
+    'Unnamed: 0': 0,
+    'energy_consumption_kwh_per_ton': 100.0,
+    'ambient_temperature_c': 25.0,
+    'humidity_percent': 50.0,
+    'process_type': 'production'
+}
+
+def load_drift_monitor():
+    """Load the baseline profile stored with the model bundle and start a live monitor"""
+    global drift_monitor
+    try:
+        if os.path.exists(DRIFT_BASELINE_PATH):
+            baseline = monitoring.Profile.load(DRIFT_BASELINE_PATH)
+            print(f"✅ Loaded drift baseline from: {DRIFT_BASELINE_PATH}")
+        elif os.path.exists(monitoring.DATA_FILE):
+            print(f"⚠️ Drift baseline not found: {DRIFT_BASELINE_PATH}, building from {monitoring.DATA_FILE}")
+            print("   Save one with: python monitoring.py")
+            baseline = monitoring.build_baseline(
+                score_fn=lambda frame: predict_batch(frame, map_process_types=False)
+            )
+        else:
+            print("⚠️ No drift baseline or training data found, drift monitoring disabled")
+            drift_monitor = None
+            return False
+        drift_monitor = monitoring.DriftMonitor(baseline, state_dir=MONITOR_STATE_DIR)
+        return True
+    except Exception as e:
+        print(f"⚠️ Drift monitoring disabled: {e}")
+        drift_monitor = None
+        return False
+
+def record_drift(data, prediction):
+    """Add one served request to the drift sketches (never fails the request)"""
+    if drift_monitor is None:
+        return
+    try:
+        features = dict(data)
+        if isinstance(features.get('process_type'), str):
+            features['process_type'] = PROCESS_TYPE_MAP.get(features['process_type'].lower(), 'production')
+        drift_monitor.update(features, prediction)
+    except Exception as e:
+        print(f"⚠️ Drift monitoring update failed: {e}")
+
+def load_candidate(model_file=None, weights=None, mode=None, sample_rate=None, canary_percent=None):
+    """Load a candidate ensemble next to the primary one and start shadow/canary evaluation"""
+    global candidate_models, candidate_preprocessing, candidate_weights, shadow_evaluator
+    model_file = model_file or CANDIDATE_MODELS_PATH
+    try:
+        loaded, _ = load_ensemble_file(model_file, tabnet_path=CANDIDATE_TABNET_PATH)
+        if not loaded:
+            raise Exception(f"no models in {model_file}")
+        
+        if CANDIDATE_PREPROCESSING_PATH:
+            prep = joblib.load(CANDIDATE_PREPROCESSING_PATH)
+        else:
+            prep = preprocessing
+        if not (isinstance(prep, dict) and 'standard_preprocessor' in prep):
+            raise Exception("candidate evaluation needs a Prototype3 'standard_preprocessor'")
+        
+        if weights is None and CANDIDATE_WEIGHTS:
+            weights = json.loads(CANDIDATE_WEIGHTS)
+        if weights is None:
+            weights = {name: 1.0 / len(loaded) for name in loaded}
+        unknown = sorted(set(weights) - set(loaded))
+        if unknown:
+            raise Exception(f"weights given for models not in the candidate: {unknown}")
+        missing = [name for name in loaded if name not in weights]
+        if missing:
+            # Same as the primary ensemble: models without a weight don't contribute
+            print(f"⚠️ No candidate weight for {missing}, using 0")
+        weights = {name: float(weights.get(name, 0.0)) for name in loaded}
+        if sum(weights.values()) <= 0:
+            raise Exception("candidate weights must sum to a positive value")
+        
+        evaluator = shadow.ShadowEvaluator(
+            predict_candidate, os.path.basename(model_file),
+            mode=mode or SHADOW_MODE,
+            sample_rate=SHADOW_SAMPLE_RATE if sample_rate is None else sample_rate,
+            canary_percent=CANARY_PERCENT if canary_percent is None else canary_percent,
+            max_added_p99_ms=SHADOW_MAX_ADDED_P99_MS
+        )
+        candidate_models, candidate_preprocessing, candidate_weights = loaded, prep, weights
+        shadow_evaluator = evaluator
+        print(f"✅ Loaded candidate ensemble from: {model_file} (models: {list(loaded.keys())})")
+        print(f"🕶️ Shadow mode: {evaluator.mode}, sample rate {evaluator.sample_rate:.0%}, "
+              f"canary {evaluator.canary_percent:.1f}%, weights {weights}")
+        return True
+    except Exception as e:
+        print(f"⚠️ Failed to load candidate ensemble {model_file}: {e}")
+        shadow_evaluator = None
+        return False
+
+def predict_candidate(data):
+    """Score one request with the candidate ensemble (same payload as predict_ensemble)"""
+    frame, errors = prepare_batch_frame(pd.DataFrame([data]))
+    if errors.iloc[0]:
+        raise Exception(errors.iloc[0])
+    members = predict_members(candidate_models, candidate_preprocessing['standard_preprocessor'], frame)
+    predictions = {name: float(members[name].iloc[0]) for name in members.columns}
+    result = build_prediction_result(predictions, weights=candidate_weights)
+    result['strategy'] = 'candidate_ensemble'
+    return result
+
 def calculate_ensemble_weights():
     """Use only XGBoost and Random Forest with equal weights (50% each)"""
     weights = {}
@@ -268,30 +542,9 @@ def predict_ensemble(data):
                 
                 # *** CRITICAL FIX: Map frontend process types to preprocessing pipeline categories ***
                 if 'process_type' in input_df.columns:
-                    process_type_map = {
-                        'shredding': 'shredding',
-                        'separation': 'separation',
-                        'melting': 'melting',
-                        'pyrolysis': 'pyrolysis',
-                        'chemical': 'chemical',
-                        'recycling': 'recycling',
-                        'composting': 'composting',
-                        'production': 'production',
-                        'recovery': 'metal_recovery',  # Map recovery to metal_recovery
-                        'treatment': 'c-si_treatment',  # Map treatment to c-si_treatment
-                        'incineration': 'incineration',
-                        'landfill': 'landfill',
-                        # Legacy mappings
-                        'cement': 'production',
-                        'steel': 'production', 
-                        'aluminum': 'recycling',
-                        'plastic': 'plastic_recovery_processing',
-                        'glass': 'glass_recovery'
-                    }
-                    
                     original_process = input_df['process_type'].iloc[0]
                     if isinstance(original_process, str):
-                        mapped_process = process_type_map.get(original_process.lower(), 'production')
+                        mapped_process = PROCESS_TYPE_MAP.get(original_process.lower(), 'production')
                         input_df['process_type'] = mapped_process
                         print(f"🔄 Mapped process type: '{original_process}' -> '{mapped_process}'")
                 
@@ -299,6 +552,14 @@ def predict_ensemble(data):
                 input_df = input_df[required_cols]
                 print(f"📊 Input data shape: {input_df.shape}, columns: {list(input_df.columns)}")
                 
+                if onnx_session is not None:
+                    # ONNX graph contains preprocessing, members and ensemble averaging
+                    member_preds, ensemble_out = onnx_session.run(None, onnx_feed(onnx_session, input_df))
+                    return build_prediction_result(
+                        {name: float(member_preds[0][i]) for i, name in enumerate(onnx_members)},
+                        ensemble_value=float(ensemble_out[0][0])
+                    )
+                
                 # Apply the complete preprocessing pipeline
                 X_processed = preprocessing['standard_preprocessor'].transform(input_df)
                 print(f"✅ Preprocessing completed. Output shape: {X_processed.shape}")
@@ -345,33 +606,10 @@ def predict_ensemble(data):
             
             # Handle basic categorical encoding for process_type
             if 'process_type' in input_df.columns:
-                # Map frontend process types to actual categories expected by preprocessing pipeline
-                # Based on the categories found in preprocessing_info_3_prototype3.pkl
-                process_type_map = {
-                    'shredding': 'shredding',
-                    'separation': 'separation',
-                    'melting': 'melting',
-                    'pyrolysis': 'pyrolysis',
-                    'chemical': 'chemical',
-                    'recycling': 'recycling',
-                    'composting': 'composting',
-                    'production': 'production',
-                    'recovery': 'metal_recovery',  # Map to available recovery category
-                    'treatment': 'c-si_treatment',  # Map to available treatment category
-                    'incineration': 'incineration',
-                    'landfill': 'landfill',
-                    # Legacy mappings for backward compatibility
-                    'cement': 'production',
-                    'steel': 'production', 
-                    'aluminum': 'recycling',
-                    'plastic': 'plastic_recovery_processing',
-                    'glass': 'glass_recovery'
-                }
-                
                 process_val = input_df['process_type'].iloc[0]
                 if isinstance(process_val, str):
                     process_val = process_val.lower()
-                    mapped_val = process_type_map.get(process_val, 'production')  # default to production
+                    mapped_val = PROCESS_TYPE_MAP.get(process_val, 'production')  # default to production
                     input_df['process_type'] = mapped_val
             
             # Ensure basic required columns exist
@@ -411,52 +649,153 @@ def predict_ensemble(data):
                 print(f"❌ Error with {model_name}: {e}")
                 continue
         
-        if not predictions:
-            raise Exception("No models could make predictions - check input format and model compatibility")
-        
-        # Use dynamic ensemble weights
-        weights = ensemble_weights if ensemble_weights else {
-            name: 1.0/len(predictions) for name in predictions.keys()
-        }
-        
-        # Ensure weights exist for all prediction models
-        active_weights = {}
-        total_weight = 0
-        for name in predictions.keys():
-            if name in weights:
-                active_weights[name] = weights[name]
-            else:
-                active_weights[name] = 1.0 / len(predictions)
-            total_weight += active_weights[name]
-        
-        # Normalize weights
-        if total_weight > 0:
-            for name in active_weights:
-                active_weights[name] = active_weights[name] / total_weight
-        
-        # Calculate ensemble prediction
-        ensemble_pred = sum(predictions[name] * active_weights[name] 
-                          for name in predictions.keys())
-        
-        # Calculate confidence based on model agreement
-        pred_values = list(predictions.values())
-        confidence = 1.0 - (np.std(pred_values) / max(np.mean(pred_values), 1.0))
-        confidence = max(0.0, min(1.0, confidence))  # Clamp to [0, 1]
-        
-        return {
-            'ensemble_prediction': round(float(ensemble_pred), 2),
-            'individual_predictions': {k: round(v, 2) for k, v in predictions.items()},
-            'weights_used': {k: round(v, 3) for k, v in active_weights.items()},
-            'confidence': round(confidence, 3),
-            'strategy': '2_model_ensemble_xgb_rf',
-            'models_used': list(predictions.keys()),
-            'input_processed': True
-        }
+        return build_prediction_result(predictions)
         
     except Exception as e:
         print(f"❌ Prediction error: {e}")
         raise Exception(f"Prediction failed: {str(e)}")
 
+def build_prediction_result(predictions, ensemble_value=None, weights=None):
+    """Combine individual model predictions into the ensemble response payload
+
+    weights defaults to the primary ensemble_weights (the shadow candidate passes its own).
+    """
+    if not predictions:
+        raise Exception("No models could make predictions - check input format and model compatibility")
+    
+    # Use dynamic ensemble weights
+    weights = weights or ensemble_weights or {
+        name: 1.0/len(predictions) for name in predictions.keys()
+    }
+    
+    # Ensure weights exist for all prediction models
+    active_weights = {}
+    total_weight = 0
+    for name in predictions.keys():
+        if name in weights:
+            active_weights[name] = weights[name]
+        else:
+            active_weights[name] = 1.0 / len(predictions)
+        total_weight += active_weights[name]
+    
+    # Normalize weights
+    if total_weight > 0:
+        for name in active_weights:
+            active_weights[name] = active_weights[name] / total_weight
+    
+    # Calculate ensemble prediction (the ONNX graph already computes it)
+    if ensemble_value is not None:
+        ensemble_pred = ensemble_value
+    else:
+        ensemble_pred = sum(predictions[name] * active_weights[name] 
+                          for name in predictions.keys())
+    
+    # Calculate confidence based on model agreement
+    pred_values = list(predictions.values())
+    confidence = 1.0 - (np.std(pred_values) / max(np.mean(pred_values), 1.0))
+    confidence = max(0.0, min(1.0, confidence))  # Clamp to [0, 1]
+    
+    return {
+        'ensemble_prediction': round(float(ensemble_pred), 2),
+        'individual_predictions': {k: round(v, 2) for k, v in predictions.items()},
+        'weights_used': {k: round(v, 3) for k, v in active_weights.items()},
+        'confidence': round(confidence, 3),
+        'strategy': '2_model_ensemble_xgb_rf',
+        'models_used': list(predictions.keys()),
+        'input_processed': True
+    }
+
+def prepare_batch_frame(input_df, map_process_types=True):
+    """Shape a frame of raw rows like predict_ensemble does for a single row
+
+    Returns (frame, errors). Columns missing from the input get the same
+    defaults as a single request; values that are present but null or
+    unparseable are never replaced, the row's message in ``errors`` is set
+    instead ('' for valid rows). map_process_types=False keeps process_type
+    values as-is (rows already using the pipeline's categories, e.g. the
+    training data).
+    """
+    input_df = input_df.reset_index(drop=True)
+    frame = pd.DataFrame(index=input_df.index)
+    problems = []
+    for col, default in STANDARD_INPUT_DEFAULTS.items():
+        if col not in input_df.columns:
+            frame[col] = default
+        elif col == 'process_type':
+            values = input_df[col]
+            problems.append(pd.Series(np.where(values.map(lambda v: isinstance(v, str)), '',
+                                               f"{col} must be a string"), index=input_df.index))
+            if map_process_types:
+                values = values.map(
+                    lambda v: PROCESS_TYPE_MAP.get(v.lower(), 'production') if isinstance(v, str) else v
+                )
+            frame[col] = values
+        else:
+            values = pd.to_numeric(input_df[col], errors='coerce')
+            problems.append(pd.Series(np.where(values.isna(), f"{col} must be a number", ''),
+                                      index=input_df.index))
+            frame[col] = values
+
+    errors = pd.Series('', index=input_df.index)
+    for problem in problems:
+        errors = errors.str.cat(problem, sep='; ').str.strip('; ')
+    return frame, errors
+
+def predict_members(model_set, preprocessor, frame):
+    """Per-model predictions (one column per model) for a prepared batch frame"""
+    X_processed = preprocessor.transform(frame)
+    result = pd.DataFrame(index=frame.index)
+    for model_name, model in model_set.items():
+        X_model = X_processed.astype(np.float32) if model_name == 'TabNet' else X_processed
+        result[model_name] = np.asarray(model.predict(X_model), dtype=np.float64).reshape(-1)
+    return result
+
+def predict_batch(input_df, map_process_types=True):
+    """Score many rows at once
+
+    Returns a frame with 'prediction', one column per model and 'error'.
+    Rows that can't be scored as given get NaN predictions and the reason
+    in 'error' ('' otherwise).
+    """
+    if not (preprocessing and isinstance(preprocessing, dict) and 'standard_preprocessor' in preprocessing):
+        # Older preprocessing bundles only support the single-row path
+        rows = []
+        for row in input_df.to_dict('records'):
+            try:
+                r = predict_ensemble(row)
+                rows.append({'prediction': r['ensemble_prediction'], **r['individual_predictions'], 'error': ''})
+            except Exception as e:
+                rows.append({'prediction': np.nan, 'error': str(e)})
+        return pd.DataFrame(rows)
+
+    frame, errors = prepare_batch_frame(input_df, map_process_types)
+    valid = (errors == '').to_numpy()
+    frame = frame[valid]
+    member_names = onnx_members if onnx_session is not None else list(models.keys())
+    result = pd.DataFrame(np.nan, index=errors.index, columns=['prediction'] + member_names)
+    if valid.any():
+        result.loc[valid] = score_batch_frame(frame)[result.columns].to_numpy()
+    result = result.round(2)
+    result['error'] = errors
+    return result
+
+def score_batch_frame(frame):
+    """'prediction' plus one column per model for a prepared frame of valid rows"""
+    if onnx_session is not None:
+        member_preds, ensemble_out = onnx_session.run(None, onnx_feed(onnx_session, frame))
+        result = pd.DataFrame(member_preds, columns=onnx_members)
+        result.insert(0, 'prediction', ensemble_out[:, 0])
+        return result
+
+    result = predict_members(models, preprocessing['standard_preprocessor'], frame)
+    weights = np.array([
+        (ensemble_weights or {}).get(name, 1.0 / len(result.columns)) for name in result.columns
+    ])
+    if weights.sum() <= 0:
+        weights = np.ones(len(result.columns))
+    result.insert(0, 'prediction', result.to_numpy() @ (weights / weights.sum()))
+    return result
+
 @app.route('/api/status')
 def status():
     tabnet_in_models = models and 'TabNet' in models if models else False
@@ -472,7 +811,9 @@ def status():
         'tabnet_loaded': tabnet_in_models,
         'individual_rmse': model_info.get('individual_rmse', {}) if model_info else {},
         'api_version': '2.1',
-        'deep_learning_enabled': tabnet_in_models
+        'deep_learning_enabled': tabnet_in_models,
+        'inference_backend': inference_backend,
+        'shadow_mode': shadow_evaluator.mode if shadow_evaluator is not None else None
     })
 
 @app.route('/api/predict', methods=['POST'])
@@ -516,8 +857,21 @@ def predict():
                     'error': f'Missing required fields: {missing_core}. Please provide: {core_required}'
                 }), 400
         
-        # Get prediction
-        result = predict_ensemble(data)
+        # Get prediction (a canary fraction may be served by the candidate ensemble)
+        served_by = 'primary'
+        result = None
+        if shadow_evaluator is not None and shadow_evaluator.choose_canary():
+            result = shadow_evaluator.run_canary(data)
+            if result is not None:
+                served_by = 'candidate'
+        if result is None:
+            shadow_busy = shadow_evaluator.worker_busy() if shadow_evaluator is not None else False
+            start = time.perf_counter()
+            result = predict_ensemble(data)
+            if shadow_evaluator is not None:
+                shadow_evaluator.observe(data, result, (time.perf_counter() - start) * 1000.0, shadow_busy)
+        # Inputs are tracked for every request, predictions only for the primary ensemble
+        record_drift(data, result['ensemble_prediction'] if served_by == 'primary' else None)
         
         # Interpret prediction level
         prediction_value = result['ensemble_prediction']
@@ -544,7 +898,8 @@ def predict():
             'input_data': data,
             'model_count': len(result['individual_predictions']),
             'timestamp': datetime.now().isoformat(),
-            'models_used': result['models_used']
+            'models_used': result['models_used'],
+            'served_by': served_by
         })
         
     except Exception as e:
@@ -588,6 +943,43 @@ def model_info_route():
         'note': '2-model ensemble: XGBoost + Random Forest with equal weights (50%-50%)'
     })
 
+@app.route('/api/monitoring/drift')
+def drift_report():
+    """Input and prediction drift (PSI/KS) of served traffic against the training baseline"""
+    if drift_monitor is None:
+        return jsonify({'success': False, 'error': 'Drift monitoring not available'}), 503
+    try:
+        return jsonify({'success': True, **drift_monitor.report(), 'timestamp': datetime.now().isoformat()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/monitoring/drift/reset', methods=['POST'])
+def drift_reset():
+    """Start a new drift window (e.g. after a deployment or an accepted shift)"""
+    if drift_monitor is None:
+        return jsonify({'success': False, 'error': 'Drift monitoring not available'}), 503
+    try:
+        drift_monitor.reset()
+        print("🔄 Drift monitoring window reset")
+        return jsonify({'success': True, 'message': 'Drift window reset', 'timestamp': datetime.now().isoformat()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/shadow')
+def shadow_report():
+    """Candidate vs primary comparison: prediction deltas and latency (incl. added primary p99)"""
+    if shadow_evaluator is None:
+        return jsonify({'success': False, 'error': 'No candidate ensemble loaded',
+                        'hint': 'Set GREENLOOP_CANDIDATE_MODELS to a joblib ensemble file'}), 404
+    return jsonify({
+        'success': True,
+        'primary_models': list(models.keys()) if models else [],
+        'candidate_models': list(candidate_models.keys()) if candidate_models else [],
+        'candidate_weights': candidate_weights,
+        **shadow_evaluator.report(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/api/train-models', methods=['POST'])
 def train_models_endpoint():
     """Endpoint to trigger model training (if needed)"""
@@ -717,6 +1109,139 @@ def tabnet_info():
         'description': 'TabNet is a deep learning architecture specifically designed for tabular data, using sequential attention to select features at each decision step.'
     })
 
+def score_job_chunk(chunk):
+    """Job worker scoring function: batch prediction plus drift sketch update (valid rows only)"""
+    result = predict_batch(chunk)
+    if drift_monitor is not None:
+        try:
+            frame, errors = prepare_batch_frame(chunk)
+            valid = (errors == '').to_numpy()
+            drift_monitor.update_batch(frame[valid], result['prediction'][valid])
+        except Exception as e:
+            print(f"⚠️ Drift monitoring update failed: {e}")
+    return result
+
+def start_job_queue():
+    """Open the persistent job queue and start its workers (resumes interrupted jobs)"""
+    global job_queue
+    job_queue = jobs.JobQueue(JOBS_DIR, score_job_chunk, max_workers=JOB_WORKERS, chunk_rows=JOB_CHUNK_ROWS)
+    job_queue.start()
+    return job_queue
+
+def job_response(job):
+    """Public view of a job row"""
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'source': job['source'],
+        'total_rows': job['total_rows'],
+        'processed_rows': job['processed_rows'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'status_url': f"/api/jobs/{job['id']}",
+        'events_url': f"/api/jobs/{job['id']}/events",
+        'result_url': f"/api/jobs/{job['id']}/result" if job['status'] == jobs.COMPLETED else None
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a scoring job from inline JSON rows or an uploaded CSV file"""
+    try:
+        if not models:
+            return jsonify({'success': False, 'error': 'Models not loaded'}), 500
+        if job_queue is None:
+            return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+        
+        core_required = ['process_type', 'energy_consumption_kwh_per_ton', 
+                        'ambient_temperature_c', 'humidity_percent']
+        
+        if 'file' in request.files:
+            upload = request.files['file']
+            header = upload.stream.readline().decode('utf-8-sig').strip().split(',')
+            upload.stream.seek(0)
+            missing = [field for field in core_required if field not in header]
+            if missing:
+                return jsonify({'success': False, 'error': f'CSV is missing columns: {missing}'}), 400
+            job = job_queue.submit_file(upload)
+        else:
+            data = request.get_json(silent=True) or {}
+            rows = data.get('rows')
+            if not isinstance(rows, list) or not rows or not all(isinstance(r, dict) for r in rows):
+                return jsonify({
+                    'success': False,
+                    'error': "Provide a non-empty 'rows' list of objects or upload a CSV as 'file'"
+                }), 400
+            missing = sorted({field for row in rows for field in core_required if field not in row})
+            if missing:
+                return jsonify({'success': False, 'error': f'Rows are missing fields: {missing}'}), 400
+            job = job_queue.submit_rows(rows)
+        
+        return jsonify({'success': True, **job_response(job)}), 202
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/jobs')
+def list_jobs():
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+    return jsonify({'success': True, 'jobs': [job_response(job) for job in job_queue.recent()]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """Poll a job's progress, or cancel it with DELETE"""
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+    if request.method == 'DELETE' and not job_queue.cancel(job_id):
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': False, 'error': f"Job already {job['status']}"}), 409
+    
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, **job_response(job)})
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events stream of job progress until the job finishes"""
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+    if job_queue.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def stream():
+        last = None
+        while True:
+            job = job_queue.get(job_id)
+            payload = json.dumps(job_response(job))
+            if payload != last:
+                yield f"data: {payload}\n\n"
+                last = payload
+            if job['status'] in jobs.TERMINAL_STATES:
+                break
+            time.sleep(1.0)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/jobs/<job_id>/result')
+def job_result(job_id):
+    """Download the scored rows of a completed job as CSV"""
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job['status'] != jobs.COMPLETED:
+        return jsonify({'success': False, 'error': f"Job is {job['status']}", **job_response(job)}), 409
+    
+    return Response(stream_with_context(job_queue.iter_result_csv(job_id)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=greenloop-{job_id}.csv'})
+
 if __name__ == '__main__':
     print("🚀 Starting GreenLoop Flask API (Ensemble Model)...")
     if load_models():
@@ -724,6 +1249,12 @@ if __name__ == '__main__':
         print(f"🎯 Using 2-model ensemble: XGBoost (50%) + Random Forest (50%)")
         print(f"📊 Loaded models: {list(models.keys())}")
         print(f"⚖️ Active models: {len([name for name in models.keys() if name in ['XGBoost', 'Random Forest']])} models")
+        # With the debug reloader only the serving child process runs job workers and monitoring
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            load_drift_monitor()
+            if CANDIDATE_MODELS_PATH:
+                load_candidate()
+            start_job_queue()
         app.run(host='0.0.0.0', port=5000, debug=True)
     else:
         print("❌ Failed to start - models not loaded")
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""Export the GreenLoop ensemble to a single ONNX graph.
+
+The exported graph takes the raw request columns (the same ones fed to
+``standard_preprocessor`` in app.py), applies the preprocessing, runs every
+ensemble member and combines them with the ensemble weights. It has two
+outputs:
+
+    member_predictions   [N, k]  one column per member (see metadata 'members')
+    ensemble_prediction  [N, 1]  weighted average of the members
+
+Usage (from the backend-flask directory):
+    python export_onnx.py                      # export + parity check + benchmark
+    python export_onnx.py --skip-benchmark     # export + parity check only
+    python export_onnx.py --threads 2          # intra-op threads for ONNX Runtime
+
+Requires: onnx, onnxruntime, skl2onnx, onnxmltools (and torch for TabNet).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import app as greenloop
+
+# Raw columns expected by standard_preprocessor, in training order
+RAW_COLUMNS = ['Unnamed: 0', 'energy_consumption_kwh_per_ton', 'ambient_temperature_c',
+               'humidity_percent', 'process_type']
+CATEGORICAL_COLUMNS = ['process_type']
+TARGET_OPSET = {'': 15, 'ai.onnx.ml': 3}
+DEFAULT_OUTPUT = "model/ensemble.onnx"
+DATA_FILE = "data/df_combined_imputed_named.csv"
+
+
+def _initial_types():
+    # Numerical inputs are double so scaling matches sklearn bit-for-bit; the tree
+    # members then see the same float32-rounded features as in Python
+    from skl2onnx.common.data_types import DoubleTensorType, StringTensorType
+    return [
+        (col, StringTensorType([None, 1]) if col in CATEGORICAL_COLUMNS else DoubleTensorType([None, 1]))
+        for col in RAW_COLUMNS
+    ]
+
+
+def _convert_member(name, model, n_features):
+    """Convert a single ensemble member to an ONNX model taking [N, n_features] floats"""
+    from skl2onnx.common.data_types import FloatTensorType
+    initial_types = [('input', FloatTensorType([None, n_features]))]
+
+    if name == 'TabNet':
+        return _convert_tabnet(model, n_features)
+
+    if type(model).__name__.startswith('XGB'):
+        import onnxmltools
+        return onnxmltools.convert_xgboost(model, initial_types=initial_types,
+                                           target_opset=TARGET_OPSET[''])
+
+    from skl2onnx import convert_sklearn
+    return convert_sklearn(model, initial_types=initial_types, target_opset=TARGET_OPSET)
+
+
+def _convert_tabnet(model, n_features):
+    """Trace the TabNet network with torch.onnx (output only, no mask loss)"""
+    import io
+    import onnx
+    import torch
+
+    class TabNetOutput(torch.nn.Module):
+        def __init__(self, network):
+            super().__init__()
+            self.network = network
+
+        def forward(self, x):
+            output, _ = self.network(x)
+            return output
+
+    wrapper = TabNetOutput(model.network).eval().to('cpu')
+    buffer = io.BytesIO()
+    torch.onnx.export(
+        wrapper, torch.zeros(1, n_features, dtype=torch.float32), buffer,
+        input_names=['input'], output_names=['variable'],
+        dynamic_axes={'input': {0: 'N'}, 'variable': {0: 'N'}},
+        opset_version=TARGET_OPSET['']
+    )
+    return onnx.load_from_string(buffer.getvalue())
+
+
+def build_ensemble_onnx(preprocessor, members, weights, allow_missing=False):
+    """Build one ONNX model: preprocessing -> members -> weighted average.
+
+    ``members`` is an ordered dict of name -> fitted model, ``weights`` maps
+    member name to its ensemble weight (normalised here). A member that fails
+    to convert aborts the export unless ``allow_missing`` is set, in which case
+    it is left out of the graph.
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+    from skl2onnx import convert_sklearn
+
+    prep = convert_sklearn(preprocessor, initial_types=_initial_types(), target_opset=TARGET_OPSET)
+    n_features = len(preprocessor.get_feature_names_out())
+    features = prep.graph.output[0].name
+
+    nodes = list(prep.graph.node)
+    initializers = list(prep.graph.initializer)
+    opsets = {op.domain: op.version for op in prep.opset_import}
+    member_outputs = []
+    member_names = []
+
+    for i, (name, model) in enumerate(members.items()):
+        try:
+            member = onnx.compose.add_prefix(_convert_member(name, model, n_features), f"m{i}_")
+        except Exception as e:
+            if not allow_missing:
+                raise Exception(f"ONNX conversion of {name} failed: {e}") from e
+            print(f"⚠️ Skipping {name}: ONNX conversion failed ({e}) - allowed by --allow-missing")
+            continue
+
+        nodes.append(helper.make_node('Cast', [features], [member.graph.input[0].name],
+                                      to=TensorProto.FLOAT, name=f"m{i}_feed"))
+        nodes.extend(member.graph.node)
+        initializers.extend(member.graph.initializer)
+        for op in member.opset_import:
+            opsets[op.domain] = max(opsets.get(op.domain, 0), op.version)
+
+        # Members emit [N, 1] (or [N] for some converters) - normalise to [N, 1]
+        reshaped = f"m{i}_prediction"
+        nodes.append(helper.make_node('Reshape', [member.graph.output[0].name, 'member_shape'],
+                                      [reshaped], name=f"m{i}_reshape"))
+        member_outputs.append(reshaped)
+        member_names.append(name)
+        print(f"✅ Converted {name} to ONNX")
+
+    if not member_outputs:
+        raise Exception("No ensemble members could be converted to ONNX")
+
+    raw_weights = np.array([weights.get(name, 0.0) for name in member_names], dtype=np.float32)
+    if raw_weights.sum() <= 0:
+        raw_weights = np.ones(len(member_names), dtype=np.float32)
+    normalized = raw_weights / raw_weights.sum()
+
+    initializers.append(numpy_helper.from_array(np.array([-1, 1], dtype=np.int64), 'member_shape'))
+    initializers.append(numpy_helper.from_array(normalized.reshape(-1, 1), 'ensemble_weights'))
+    nodes.append(helper.make_node('Concat', member_outputs, ['member_predictions'], axis=1,
+                                  name='concat_members'))
+    nodes.append(helper.make_node('MatMul', ['member_predictions', 'ensemble_weights'],
+                                  ['ensemble_prediction'], name='weighted_average'))
+
+    graph = helper.make_graph(
+        nodes, 'greenloop_ensemble', list(prep.graph.input),
+        [helper.make_tensor_value_info('member_predictions', TensorProto.FLOAT, [None, len(member_names)]),
+         helper.make_tensor_value_info('ensemble_prediction', TensorProto.FLOAT, [None, 1])],
+        initializer=initializers
+    )
+    onnx_model = helper.make_model(
+        graph, producer_name='greenloop',
+        opset_imports=[helper.make_opsetid(domain, version) for domain, version in opsets.items()]
+    )
+    onnx_model.ir_version = prep.ir_version
+    helper.set_model_props(onnx_model, {
+        'members': json.dumps(member_names),
+        'weights': json.dumps([float(w) for w in normalized]),
+        'raw_columns': json.dumps(RAW_COLUMNS),
+    })
+    onnx.checker.check_model(onnx_model)
+    return onnx_model
+
+
+def load_sample_inputs(limit=None):
+    """Raw feature frame from the training data, shaped like app.py's input_df"""
+    df = pd.read_csv(DATA_FILE)
+    if limit:
+        df = df.head(limit)
+    return df[RAW_COLUMNS].reset_index(drop=True)
+
+
+def predict_native(frame, members, weights):
+    """Reference prediction with the sklearn/XGBoost/TabNet objects"""
+    X_processed = greenloop.preprocessing['standard_preprocessor'].transform(frame)
+    columns = []
+    for name, model in members.items():
+        X = X_processed.astype(np.float32) if name == 'TabNet' else X_processed
+        columns.append(np.asarray(model.predict(X), dtype=np.float64).reshape(-1))
+    member_preds = np.column_stack(columns)
+    w = np.array([weights.get(name, 0.0) for name in members], dtype=np.float64)
+    if w.sum() <= 0:
+        w = np.ones(len(members))
+    return member_preds, member_preds @ (w / w.sum())
+
+
+def check_parity(session, frame, members, weights, exported, atol):
+    """Compare ONNX Runtime against the full native ensemble; returns True when within tolerance.
+
+    Every exported member and the ensemble output must be within ``atol``;
+    members missing from the graph are reported and only pass if the
+    ensemble still matches (i.e. they had no weight).
+    """
+    native_members, native_ensemble = predict_native(frame, members, weights)
+    onnx_members, onnx_ensemble = session.run(None, greenloop.onnx_feed(session, frame))
+
+    ok = True
+    print(f"🔍 Parity on {len(frame)} rows (atol={atol}):")
+    for i, name in enumerate(members):
+        if name not in exported:
+            print(f"   {name}: ❌ missing from the ONNX graph")
+            continue
+        diff = np.abs(native_members[:, i] - onnx_members[:, exported.index(name)])
+        within = diff.max() <= atol
+        ok = ok and within
+        print(f"   {name}: max |diff| = {diff.max():.6f}, mean |diff| = {diff.mean():.6f}"
+              f"{'' if within else '  ❌'}")
+
+    ensemble_diff = np.abs(native_ensemble - onnx_ensemble.reshape(-1))
+    print(f"   Ensemble: max |diff| = {ensemble_diff.max():.6f}")
+    ok = ok and ensemble_diff.max() <= atol
+
+    if not ok:
+        print("❌ ONNX ensemble does not match the native backend")
+        return False
+    print("✅ ONNX ensemble matches the native backend")
+    return True
+
+
+def _latency_summary(samples):
+    samples_ms = np.array(samples) * 1000.0
+    return (f"mean {samples_ms.mean():.3f} ms, p50 {np.percentile(samples_ms, 50):.3f} ms, "
+            f"p99 {np.percentile(samples_ms, 99):.3f} ms")
+
+
+def benchmark(session, frame, members, weights, repeats):
+    """Single-row and full-batch latency of the native vs ONNX Runtime backends"""
+    rows = [frame.iloc[[i % len(frame)]] for i in range(repeats)]
+    feeds = [greenloop.onnx_feed(session, row) for row in rows]
+
+    native, onnx_rt = [], []
+    for row, feed in zip(rows, feeds):
+        start = time.perf_counter()
+        predict_native(row, members, weights)
+        native.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        session.run(None, feed)
+        onnx_rt.append(time.perf_counter() - start)
+
+    print(f"⏱️ Single-row latency over {repeats} requests:")
+    print(f"   native: {_latency_summary(native)}")
+    print(f"   onnx:   {_latency_summary(onnx_rt)}")
+
+    start = time.perf_counter()
+    predict_native(frame, members, weights)
+    native_batch = time.perf_counter() - start
+    batch_feed = greenloop.onnx_feed(session, frame)
+    start = time.perf_counter()
+    session.run(None, batch_feed)
+    onnx_batch = time.perf_counter() - start
+    print(f"⏱️ Batch of {len(frame)} rows: native {native_batch * 1000:.2f} ms, "
+          f"onnx {onnx_batch * 1000:.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the GreenLoop ensemble to ONNX")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Path of the exported .onnx file")
+    parser.add_argument('--threads', type=int, default=greenloop.ONNX_INTRA_OP_THREADS,
+                        help="ONNX Runtime intra-op threads used for verification")
+    parser.add_argument('--atol', type=float, default=1e-2,
+                        help="Max allowed |native - onnx| difference per member and for the ensemble "
+                             "(kg CO2e/ton)")
+    parser.add_argument('--repeats', type=int, default=500, help="Benchmark iterations")
+    parser.add_argument('--skip-parity', action='store_true')
+    parser.add_argument('--skip-benchmark', action='store_true')
+    parser.add_argument('--allow-missing', action='store_true',
+                        help="Leave out members that fail to convert instead of aborting")
+    args = parser.parse_args(argv)
+
+    print("🚀 Exporting ensemble to ONNX...")
+    if not greenloop.load_models(backend='native'):
+        print("❌ Failed to load models")
+        return 1
+    if not greenloop.preprocessing or 'standard_preprocessor' not in greenloop.preprocessing:
+        print("❌ ONNX export needs the Prototype3 'standard_preprocessor'")
+        return 1
+
+    members = {name: model for name, model in greenloop.models.items()}
+    weights = greenloop.ensemble_weights or {name: 1.0 for name in members}
+    try:
+        onnx_model = build_ensemble_onnx(greenloop.preprocessing['standard_preprocessor'], members, weights,
+                                         allow_missing=args.allow_missing)
+    except Exception as e:
+        print(f"❌ {e}")
+        return 1
+
+    with open(args.output, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"✅ Saved ONNX ensemble to: {args.output}")
+
+    exported = json.loads({p.key: p.value for p in onnx_model.metadata_props}['members'])
+    session = greenloop.create_onnx_session(args.output, args.threads)
+    frame = load_sample_inputs()
+
+    # Verify against the full native ensemble, not just the exported members
+    if not args.skip_parity and not check_parity(session, frame, members, weights, exported, args.atol):
+        os.remove(args.output)
+        print(f"🗑️ Removed {args.output} so it cannot be served")
+        return 1
+    if not args.skip_benchmark:
+        benchmark(session, frame, {name: members[name] for name in exported}, weights, args.repeats)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""Asynchronous scoring jobs for large batches.
+
+Jobs are persisted in a local SQLite database (no external broker) and run by
+a bounded pool of worker threads. Input is read and scored in chunks; each
+scored chunk is written to its own CSV part file before the job's progress is
+committed, so a job interrupted by a server restart resumes from the last
+completed chunk instead of starting over.
+
+Several server processes may share one jobs directory. A running job records
+the worker that claimed it (host, pid and a per-queue token) and a heartbeat
+that the owner refreshes while it is alive. Only jobs whose owner process is
+gone (same host) or whose heartbeat has gone stale are requeued, so a
+restarting process never steals work from a live peer.
+
+Layout of the jobs directory:
+    jobs.db                       job table
+    <job_id>/input.csv            rows submitted inline or uploaded
+    <job_id>/result/part-NNNNN.csv   scored chunks (input columns + predictions)
+"""
+import io
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TERMINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    total_rows INTEGER,
+    processed_rows INTEGER NOT NULL DEFAULT 0,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    heartbeat_at REAL,
+    input_offset INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Columns added after the first release; older jobs.db files are migrated in place
+_MIGRATIONS = {
+    'owner': "ALTER TABLE jobs ADD COLUMN owner TEXT",
+    'heartbeat_at': "ALTER TABLE jobs ADD COLUMN heartbeat_at REAL",
+    'input_offset': "ALTER TABLE jobs ADD COLUMN input_offset INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """SQLite-backed job queue executed by a local pool of worker threads"""
+
+    def __init__(self, jobs_dir, score_fn, max_workers=2, chunk_rows=50000, poll_interval=1.0,
+                 heartbeat_interval=5.0, stale_after=60.0):
+        self.jobs_dir = jobs_dir
+        self.score_fn = score_fn
+        self.max_workers = max_workers
+        self.chunk_rows = chunk_rows
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = max(stale_after, 3 * heartbeat_interval)
+        self.db_path = os.path.join(jobs_dir, 'jobs.db')
+        self.hostname = socket.gethostname()
+        self.owner = f"{self.hostname}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+
+        os.makedirs(jobs_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, statement in _MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection per operation; commits on success and always closes"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _now(self):
+        return datetime.now().isoformat()
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def input_path(self, job_id):
+        return os.path.join(self._job_dir(job_id), 'input.csv')
+
+    def result_dir(self, job_id):
+        return os.path.join(self._job_dir(job_id), 'result')
+
+    # ------------------------------------------------------------------
+    # Submission and inspection
+    # ------------------------------------------------------------------
+    def _create(self, job_id, source, total_rows):
+        now = self._now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, source, created_at, updated_at, total_rows) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, source, now, now, total_rows)
+            )
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def submit_rows(self, rows):
+        """Queue a job for a list of row dicts"""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_dir(job_id))
+        pd.DataFrame(rows).to_csv(self.input_path(job_id), index=False)
+        return self._create(job_id, 'inline', len(rows))
+
+    def submit_file(self, upload):
+        """Queue a job for an uploaded CSV (werkzeug FileStorage)"""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_dir(job_id))
+        upload.save(self.input_path(job_id))
+        # Row count is filled in by the worker so large uploads return immediately
+        return self._create(job_id, 'upload', None)
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        total = job['total_rows']
+        if total:
+            job['progress'] = round(job['processed_rows'] / total, 4)
+        else:
+            job['progress'] = 1.0 if job['status'] == COMPLETED else 0.0
+        return job
+
+    def recent(self, limit=50):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self.get(row['id']) for row in rows]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; running jobs stop after their current chunk"""
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, self._now(), job_id, QUEUED, RUNNING)
+            ).rowcount
+        return updated == 1
+
+    def result_parts(self, job_id):
+        result_dir = self.result_dir(job_id)
+        if not os.path.isdir(result_dir):
+            return []
+        return sorted(
+            os.path.join(result_dir, name) for name in os.listdir(result_dir)
+            if name.startswith('part-') and name.endswith('.csv')
+        )
+
+    def iter_result_csv(self, job_id):
+        """Yield the result parts as one CSV stream (header from the first part only)"""
+        for i, part in enumerate(self.result_parts(job_id)):
+            with open(part, 'r', encoding='utf-8') as f:
+                header = f.readline()
+                if i == 0:
+                    yield header
+                for line in f:
+                    yield line
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+    def start(self):
+        """Requeue orphaned jobs and start the worker and heartbeat threads"""
+        resumed = self.requeue_orphans()
+        if resumed:
+            print(f"🔁 Resuming {resumed} interrupted job(s)")
+
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        self._workers.append(heartbeat)
+        print(f"✅ Job queue started: {self.max_workers} worker(s), {self.chunk_rows} rows per chunk")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _owner_gone(self, owner):
+        """True if the owner ran on this host and its process no longer exists"""
+        if not owner:
+            return True
+        try:
+            host, pid, _ = owner.rsplit(':', 2)
+            pid = int(pid)
+        except ValueError:
+            return False
+        return host == self.hostname and pid != os.getpid() and not _pid_alive(pid)
+
+    def requeue_orphans(self):
+        """Move running jobs back to queued if their owner is gone or its heartbeat is stale"""
+        cutoff = time.time() - self.stale_after
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, owner, heartbeat_at FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            requeued = 0
+            for row in rows:
+                stale = row['heartbeat_at'] is None or row['heartbeat_at'] < cutoff
+                if not stale and not self._owner_gone(row['owner']):
+                    continue
+                # Match the owner we inspected so a job reclaimed meanwhile is left alone
+                requeued += conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, heartbeat_at = NULL, updated_at = ? "
+                    "WHERE id = ? AND status = ? AND owner IS ?",
+                    (QUEUED, self._now(), row['id'], RUNNING, row['owner'])
+                ).rowcount
+        if requeued:
+            self._wakeup.set()
+        return requeued
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                        (time.time(), self.owner, RUNNING)
+                    )
+                requeued = self.requeue_orphans()
+                if requeued:
+                    print(f"🔁 Requeued {requeued} job(s) from a stopped worker")
+            except sqlite3.Error as e:
+                print(f"⚠️ Job heartbeat failed: {e}")
+
+    def _claim_next(self):
+        """Atomically move the oldest queued job to running, owned by this queue"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                         (RUNNING, self.owner, time.time(), self._now(), row['id']))
+        return row['id']
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            job_id = self._claim_next()
+            if job_id is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"❌ Job {job_id} failed: {e}")
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                        "WHERE id = ? AND status = ? AND owner = ?",
+                        (FAILED, str(e), self._now(), job_id, RUNNING, self.owner)
+                    )
+
+    def _count_rows(self, path):
+        """Data rows in a CSV (header excluded) without loading it into memory"""
+        lines = 0
+        last = b'\n'
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            lines += 1
+        return max(0, lines - 1)
+
+    def _read_records(self, f, limit, keep=True):
+        """Read up to ``limit`` CSV records as raw bytes from the current position
+
+        A line ends a record only when the quotes seen so far are balanced, so
+        quoted fields containing newlines stay in one record. With keep=False
+        the records are only skipped and an empty list is returned.
+        """
+        records = []
+        pending = b''
+        read = 0
+        while read < limit:
+            line = f.readline()
+            if not line:
+                break
+            pending += line
+            if pending.count(b'"') % 2 == 0:
+                if keep:
+                    records.append(pending)
+                pending = b''
+                read += 1
+        if pending and keep:
+            records.append(pending)
+        return records
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        path = self.input_path(job_id)
+        result_dir = self.result_dir(job_id)
+        os.makedirs(result_dir, exist_ok=True)
+
+        if job['total_rows'] is None:
+            with self._connect() as conn:
+                conn.execute("UPDATE jobs SET total_rows = ? WHERE id = ?", (self._count_rows(path), job_id))
+
+        chunks_done = job['chunks_done']
+        processed = job['processed_rows']
+        if chunks_done:
+            print(f"🔁 Job {job_id}: resuming after chunk {chunks_done}")
+
+        with open(path, 'rb') as f:
+            header = f.readline()
+            if job['input_offset']:
+                # Seek past the rows already scored before a restart instead of re-reading them
+                f.seek(job['input_offset'])
+            elif processed:
+                # Jobs started before offsets were recorded: skip the scored records unparsed
+                self._read_records(f, processed, keep=False)
+            self._run_chunks(job_id, f, header, chunks_done, processed)
+
+    def _run_chunks(self, job_id, f, header, chunks_done, processed):
+        result_dir = self.result_dir(job_id)
+        index = chunks_done
+        while True:
+            records = self._read_records(f, self.chunk_rows)
+            if not records:
+                break
+            offset = f.tell()
+            chunk = pd.read_csv(io.BytesIO(header + b''.join(records)))
+            if chunk.empty:
+                continue
+
+            current = self.get(job_id)
+            if current['status'] != RUNNING:
+                print(f"⏹️ Job {job_id} cancelled")
+                return
+            if current['owner'] != self.owner:
+                print(f"⚠️ Job {job_id} was requeued by another worker, stopping")
+                return
+
+            scored = self.score_fn(chunk)
+            output = pd.concat([chunk.reset_index(drop=True), scored.reset_index(drop=True)], axis=1)
+
+            # Write the part atomically, then commit progress
+            part = os.path.join(result_dir, f"part-{index:05d}.csv")
+            output.to_csv(part + '.tmp', index=False)
+            os.replace(part + '.tmp', part)
+            processed += len(chunk)
+            index += 1
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE jobs SET chunks_done = ?, processed_rows = ?, input_offset = ?, heartbeat_at = ?, "
+                    "updated_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                    (index, processed, offset, time.time(), self._now(), job_id, RUNNING, self.owner)
+                )
+
+        with self._connect() as conn:
+            completed = conn.execute(
+                "UPDATE jobs SET status = ?, total_rows = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND owner = ?",
+                (COMPLETED, processed, self._now(), job_id, RUNNING, self.owner)
+            ).rowcount
+        if completed:
+            print(f"✅ Job {job_id} completed: {processed} rows")
@@ -0,0 +1,490 @@
+"""Incremental input/prediction drift monitoring.
+
+Incoming requests are summarised in small streaming sketches instead of being
+logged and re-scanned:
+
+    HistogramSketch  fixed-edge histogram (edges = baseline deciles) plus
+                     count/sum/sum of squares/min/max; O(1) update per value
+    CategorySketch   per-category counts (process_type)
+
+Both are mergeable by adding counts, so sketches written by several server
+processes can be combined. Drift is reported against a baseline profile built
+from the training data and stored with the model bundle
+(model/drift_baseline.json):
+
+    PSI  population stability index over the histogram bins / categories
+    KS   max distance between the binned CDFs (approximate two-sample KS)
+
+Build or refresh the baseline (from the backend-flask directory):
+    python monitoring.py
+"""
+import atexit
+import bisect
+import glob
+import hashlib
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+NUMERICAL_FEATURES = ['energy_consumption_kwh_per_ton', 'ambient_temperature_c', 'humidity_percent']
+CATEGORICAL_FEATURES = ['process_type']
+PREDICTION = 'prediction'
+DEFAULT_BASELINE_PATH = "model/drift_baseline.json"
+DATA_FILE = "data/df_combined_imputed_named.csv"
+
+# Common PSI rule of thumb: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 significant
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+_EPSILON = 1e-4
+
+
+def drift_status(psi):
+    if psi is None:
+        return 'insufficient_data'
+    if psi >= PSI_SIGNIFICANT:
+        return 'significant'
+    if psi >= PSI_MODERATE:
+        return 'moderate'
+    return 'stable'
+
+
+def psi_score(expected_counts, actual_counts):
+    """Population stability index between two aligned count vectors"""
+    expected = np.asarray(expected_counts, dtype=np.float64)
+    actual = np.asarray(actual_counts, dtype=np.float64)
+    if expected.sum() == 0 or actual.sum() == 0:
+        return None
+    e = np.clip(expected / expected.sum(), _EPSILON, None)
+    a = np.clip(actual / actual.sum(), _EPSILON, None)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def ks_score(expected_counts, actual_counts):
+    """Max |CDF difference| over the shared bins"""
+    expected = np.asarray(expected_counts, dtype=np.float64)
+    actual = np.asarray(actual_counts, dtype=np.float64)
+    if expected.sum() == 0 or actual.sum() == 0:
+        return None
+    return float(np.max(np.abs(np.cumsum(expected) / expected.sum() - np.cumsum(actual) / actual.sum())))
+
+
+class HistogramSketch:
+    """Fixed-edge histogram with running moments; mergeable when edges match"""
+
+    def __init__(self, edges, counts=None, count=0, total=0.0, total_sq=0.0, minimum=None, maximum=None):
+        self.edges = [float(e) for e in edges]
+        self.counts = list(counts) if counts is not None else [0] * (len(self.edges) + 1)
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def from_values(cls, values, bins=10):
+        """Sketch of a reference sample with quantile edges (equal-mass bins)"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])) if len(values) else []
+        sketch = cls(edges)
+        sketch.update_many(values)
+        return sketch
+
+    def update(self, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        if math.isnan(value):
+            return
+        self.counts[bisect.bisect_right(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def update_many(self, values):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').dropna().to_numpy(dtype=np.float64)
+        if not len(values):
+            return
+        bins = np.searchsorted(self.edges, values, side='right')
+        for index, n in zip(*np.unique(bins, return_counts=True)):
+            self.counts[int(index)] += int(n)
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.total_sq += float(np.square(values).sum())
+        self.minimum = float(values.min()) if self.minimum is None else min(self.minimum, float(values.min()))
+        self.maximum = float(values.max()) if self.maximum is None else max(self.maximum, float(values.max()))
+
+    def merge(self, other):
+        if self.edges != other.edges:
+            raise ValueError("Cannot merge histograms with different bin edges")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        for attr, pick in (('minimum', min), ('maximum', max)):
+            values = [v for v in (getattr(self, attr), getattr(other, attr)) if v is not None]
+            setattr(self, attr, pick(values) if values else None)
+        return self
+
+    def empty_copy(self):
+        return HistogramSketch(self.edges)
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        mean = self.total / self.count
+        variance = max(self.total_sq / self.count - mean * mean, 0.0)
+        return {
+            'count': self.count,
+            'mean': round(mean, 4),
+            'std': round(math.sqrt(variance), 4),
+            'min': round(self.minimum, 4),
+            'max': round(self.maximum, 4)
+        }
+
+    def to_dict(self):
+        return {
+            'edges': self.edges, 'counts': self.counts, 'count': self.count, 'total': self.total,
+            'total_sq': self.total_sq, 'minimum': self.minimum, 'maximum': self.maximum
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class CategorySketch:
+    """Per-category counts; mergeable by addition"""
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    def update(self, value):
+        key = str(value)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def update_many(self, values):
+        for key, n in pd.Series(values).astype(str).value_counts().items():
+            self.counts[key] = self.counts.get(key, 0) + int(n)
+
+    def merge(self, other):
+        for key, n in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + n
+        return self
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def empty_copy(self):
+        return CategorySketch()
+
+    def to_dict(self):
+        return {'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('counts'))
+
+
+class Profile:
+    """Sketches for every monitored feature plus the ensemble prediction"""
+
+    def __init__(self, numerical, categorical, created_at=None):
+        self.numerical = numerical      # name -> HistogramSketch (includes 'prediction')
+        self.categorical = categorical  # name -> CategorySketch
+        self.created_at = created_at or datetime.now().isoformat()
+
+    @classmethod
+    def from_frame(cls, frame, predictions=None, bins=10):
+        numerical = {col: HistogramSketch.from_values(frame[col], bins) for col in NUMERICAL_FEATURES}
+        if predictions is not None:
+            numerical[PREDICTION] = HistogramSketch.from_values(predictions, bins)
+        categorical = {}
+        for col in CATEGORICAL_FEATURES:
+            categorical[col] = CategorySketch()
+            categorical[col].update_many(frame[col])
+        return cls(numerical, categorical)
+
+    def empty_copy(self):
+        """Profile with the same bins and no observations"""
+        return Profile({k: v.empty_copy() for k, v in self.numerical.items()},
+                       {k: v.empty_copy() for k, v in self.categorical.items()})
+
+    @property
+    def count(self):
+        sketch = next(iter(self.categorical.values()), None)
+        return sketch.count if sketch else 0
+
+    def merge(self, other):
+        for name, sketch in other.numerical.items():
+            if name in self.numerical:
+                self.numerical[name].merge(sketch)
+        for name, sketch in other.categorical.items():
+            self.categorical.setdefault(name, CategorySketch()).merge(sketch)
+        self.created_at = min(self.created_at, other.created_at)
+        return self
+
+    def to_dict(self):
+        return {
+            'created_at': self.created_at,
+            'numerical': {k: v.to_dict() for k, v in self.numerical.items()},
+            'categorical': {k: v.to_dict() for k, v in self.categorical.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({k: HistogramSketch.from_dict(v) for k, v in data['numerical'].items()},
+                   {k: CategorySketch.from_dict(v) for k, v in data['categorical'].items()},
+                   data.get('created_at'))
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def fingerprint(self):
+        """Short hash of the bins and counts (not created_at), identifying a baseline"""
+        data = self.to_dict()
+        data.pop('created_at')
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def compare_profiles(baseline, current, min_count=30):
+    """Drift report of ``current`` against ``baseline``"""
+    report = {'features': {}, 'process_type': {}, 'prediction': None}
+    scores = []
+
+    for name, base in baseline.numerical.items():
+        sketch = current.numerical.get(name)
+        enough = sketch is not None and sketch.count >= min_count
+        psi = psi_score(base.counts, sketch.counts) if enough else None
+        entry = {
+            'psi': None if psi is None else round(psi, 4),
+            'ks': round(ks_score(base.counts, sketch.counts), 4) if enough else None,
+            'status': drift_status(psi),
+            'current': sketch.summary() if sketch else {'count': 0},
+            'baseline': base.summary()
+        }
+        if psi is not None:
+            scores.append(psi)
+        if name == PREDICTION:
+            report['prediction'] = entry
+        else:
+            report['features'][name] = entry
+
+    for name, base in baseline.categorical.items():
+        sketch = current.categorical.get(name, CategorySketch())
+        categories = sorted(set(base.counts) | set(sketch.counts))
+        enough = sketch.count >= min_count
+        psi = psi_score([base.counts.get(c, 0) for c in categories],
+                        [sketch.counts.get(c, 0) for c in categories]) if enough else None
+        if psi is not None:
+            scores.append(psi)
+        report[name] = {
+            'psi': None if psi is None else round(psi, 4),
+            'status': drift_status(psi),
+            'current_counts': sketch.counts,
+            'unseen_categories': sorted(set(sketch.counts) - set(base.counts))
+        }
+
+    report['max_psi'] = round(max(scores), 4) if scores else None
+    report['overall_status'] = drift_status(report['max_psi'])
+    return report
+
+
+class DriftMonitor:
+    """Thread-safe live profile for one server process.
+
+    Each process writes its profile to ``state_dir`` every ``flush_interval``
+    seconds as ``<baseline fingerprint>-<host>-<pid>-<random>.json`` and
+    removes it at exit; ``merged_profile()`` combines the files built against
+    the same baseline so any worker can report drift for the whole deployment.
+    Files not refreshed for ``stale_flushes`` intervals (crashed or killed
+    workers, old baselines) are ignored and deleted. ``reset()`` starts a new
+    window for every process sharing ``state_dir``.
+    """
+
+    def __init__(self, baseline, state_dir=None, flush_interval=30.0, min_count=30, stale_flushes=4):
+        self.baseline = baseline
+        self.profile = baseline.empty_copy()
+        self.state_dir = state_dir
+        self.flush_interval = flush_interval
+        self.min_count = min_count
+        self.max_state_age = stale_flushes * flush_interval
+        self.baseline_id = baseline.fingerprint()
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._window_started = time.time()
+        self._stop = threading.Event()
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            self._flusher = threading.Thread(target=self._flush_loop, name='drift-flush', daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    @property
+    def state_path(self):
+        return os.path.join(self.state_dir, f"{self.baseline_id}-{self.worker_id}.json")
+
+    @property
+    def reset_marker(self):
+        return os.path.join(self.state_dir, f"{self.baseline_id}.reset")
+
+    def update(self, features, prediction=None):
+        """Record one request (dict of raw features, already-mapped process_type)"""
+        with self._lock:
+            for name in NUMERICAL_FEATURES:
+                if name in features:
+                    self.profile.numerical[name].update(features[name])
+            for name in CATEGORICAL_FEATURES:
+                if name in features:
+                    self.profile.categorical[name].update(features[name])
+            if prediction is not None and PREDICTION in self.profile.numerical:
+                self.profile.numerical[PREDICTION].update(prediction)
+
+    def update_batch(self, frame, predictions=None):
+        """Record a scored batch (e.g. a job chunk) with vectorised updates"""
+        with self._lock:
+            for name in NUMERICAL_FEATURES:
+                if name in frame.columns:
+                    self.profile.numerical[name].update_many(frame[name])
+            for name in CATEGORICAL_FEATURES:
+                if name in frame.columns:
+                    self.profile.categorical[name].update_many(frame[name])
+            if predictions is not None and PREDICTION in self.profile.numerical:
+                self.profile.numerical[PREDICTION].update_many(predictions)
+
+    def _flush_loop(self):
+        # Flush even without new requests so the file's mtime shows this worker is alive
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ Drift monitoring flush failed: {e}")
+
+    def _reset_time(self):
+        try:
+            return os.path.getmtime(self.reset_marker)
+        except OSError:
+            return 0.0
+
+    def _clear_window(self):
+        with self._lock:
+            self.profile = self.baseline.empty_copy()
+            self._window_started = time.time()
+
+    def flush(self):
+        """Write this process's profile so other workers can merge it"""
+        if not self.state_dir:
+            return
+        # Pick up a reset requested by another worker before publishing old counts
+        if self._reset_time() > self._window_started:
+            self._clear_window()
+        with self._lock:
+            snapshot = Profile.from_dict(self.profile.to_dict())
+        snapshot.save(self.state_path)
+
+    def reset(self):
+        """Start a new monitoring window (all workers sharing state_dir follow on their next flush)"""
+        self._clear_window()
+        if not self.state_dir:
+            return
+        with open(self.reset_marker, 'w', encoding='utf-8') as f:
+            f.write(datetime.now().isoformat())
+        for path in glob.glob(os.path.join(self.state_dir, f"{self.baseline_id}-*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.flush()
+
+    def close(self):
+        """Stop flushing and remove this process's state file"""
+        self._stop.set()
+        if self.state_dir:
+            try:
+                os.remove(self.state_path)
+            except OSError:
+                pass
+
+    def merged_profile(self):
+        """This process's live profile merged with the current state of other workers"""
+        if self.state_dir and self._reset_time() > self._window_started:
+            self._clear_window()
+        with self._lock:
+            merged = Profile.from_dict(self.profile.to_dict())
+        if not self.state_dir:
+            return merged, 1
+        workers = 1
+        now = time.time()
+        reset_time = self._reset_time()
+        for path in glob.glob(os.path.join(self.state_dir, '*.json')):
+            if path == self.state_path:
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime > self.max_state_age:
+                    # Worker exited without cleanup, or the file belongs to an old baseline
+                    os.remove(path)
+                    continue
+                if not os.path.basename(path).startswith(f"{self.baseline_id}-") or mtime < reset_time:
+                    continue
+                merged.merge(Profile.load(path))
+                workers += 1
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Skipping monitoring state {path}: {e}")
+        return merged, workers
+
+    def report(self):
+        current, workers = self.merged_profile()
+        report = compare_profiles(self.baseline, current, self.min_count)
+        report['window'] = {'since': current.created_at, 'requests': current.count, 'workers': workers}
+        report['baseline_created_at'] = self.baseline.created_at
+        report['baseline_id'] = self.baseline_id
+        return report
+
+
+def build_baseline(data_file=DATA_FILE, score_fn=None):
+    """Baseline profile from the training data (predictions added when score_fn is given)"""
+    frame = pd.read_csv(data_file)
+    predictions = score_fn(frame)['prediction'] if score_fn else None
+    return Profile.from_frame(frame, predictions)
+
+
+def main(argv=None):
+    output = (argv or sys.argv[1:] or [DEFAULT_BASELINE_PATH])[0]
+
+    import app as greenloop
+    if not greenloop.load_models(backend='native'):
+        print("❌ Failed to load models")
+        return 1
+    # Training rows already use pipeline categories, so skip the frontend mapping
+    baseline = build_baseline(score_fn=lambda frame: greenloop.predict_batch(frame, map_process_types=False))
+    baseline.save(output)
+    print(f"✅ Saved drift baseline ({baseline.count} rows) to: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Shadow and canary evaluation of a candidate ensemble on live traffic.
+
+A candidate bundle (e.g. the ensemble with TabNet re-enabled, or different
+weights) is loaded next to the primary one:
+
+    shadow  a sample of /api/predict requests is re-scored by the candidate on
+            a background thread after the primary response is computed; the
+            caller never waits for it
+    canary  additionally, a percentage of requests is served by the candidate
+            (falling back to the primary if the candidate fails)
+
+The only work added to the primary request path is a random draw and a
+non-blocking queue put. The background scoring still competes for CPU, so
+primary latency is tracked separately while the candidate worker is busy and
+while it is idle. If the p99 difference exceeds the configured budget,
+shadow sampling pauses for a cooldown period.
+"""
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+SHADOW = 'shadow'
+CANARY = 'canary'
+
+
+class LatencyWindow:
+    """Rolling window of latencies in milliseconds"""
+
+    def __init__(self, size=1000):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, ms):
+        with self._lock:
+            self._values.append(ms)
+
+    def __len__(self):
+        return len(self._values)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def percentile(self, p):
+        with self._lock:
+            values = list(self._values)
+        return float(np.percentile(values, p)) if values else None
+
+    def summary(self):
+        with self._lock:
+            values = np.array(self._values)
+        if not len(values):
+            return {'count': 0}
+        return {
+            'count': int(len(values)),
+            'mean_ms': round(float(values.mean()), 3),
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p99_ms': round(float(np.percentile(values, 99)), 3)
+        }
+
+
+class ShadowEvaluator:
+    """Scores sampled traffic with a candidate and records latency / prediction deltas.
+
+    ``candidate_fn(data)`` must return a prediction result dict with
+    'ensemble_prediction' and 'individual_predictions' (see app.build_prediction_result).
+    """
+
+    def __init__(self, candidate_fn, candidate_name, mode=SHADOW, sample_rate=0.1, canary_percent=0.0,
+                 max_queue=100, max_added_p99_ms=5.0, cooldown_seconds=30.0, min_samples=100, window=1000):
+        if mode not in (SHADOW, CANARY):
+            raise ValueError(f"Unknown shadow mode '{mode}' (expected '{SHADOW}' or '{CANARY}')")
+        self.candidate_fn = candidate_fn
+        self.candidate_name = candidate_name
+        self.mode = mode
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.canary_percent = max(0.0, min(100.0, canary_percent)) if mode == CANARY else 0.0
+        self.max_added_p99_ms = max_added_p99_ms
+        self.cooldown_seconds = cooldown_seconds
+        self.min_samples = min_samples
+
+        self.primary_latency = LatencyWindow(window)
+        self.primary_latency_busy = LatencyWindow(window)
+        self.primary_latency_idle = LatencyWindow(window)
+        self.enqueue_latency = LatencyWindow(window)
+        self.candidate_latency = LatencyWindow(window)
+        self.canary_latency = LatencyWindow(window)
+        self.recent = deque(maxlen=50)
+        self.started_at = datetime.now().isoformat()
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._busy = threading.Event()
+        self._paused_until = 0.0
+        self._next_budget_check = 0.0
+        self._counts = {'sampled': 0, 'compared': 0, 'dropped': 0, 'candidate_errors': 0,
+                        'canary_served': 0, 'canary_fallbacks': 0, 'paused_skips': 0, 'pauses': 0}
+        self._delta = {'sum': 0.0, 'sum_abs': 0.0, 'sum_sq': 0.0, 'max_abs': 0.0}
+        self._model_deltas = {}
+
+        self._worker = threading.Thread(target=self._worker_loop, name='shadow-worker', daemon=True)
+        self._worker.start()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counts[key] += n
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+    def worker_busy(self):
+        """Snapshot taken at request start to attribute primary latency"""
+        return self._busy.is_set() or not self._queue.empty()
+
+    def choose_canary(self):
+        return self.canary_percent > 0 and random.random() * 100.0 < self.canary_percent
+
+    def run_canary(self, data):
+        """Serve a request with the candidate; returns None (use primary) on failure"""
+        start = time.perf_counter()
+        try:
+            result = self.candidate_fn(data)
+        except Exception as e:
+            print(f"⚠️ Canary candidate failed, serving primary: {e}")
+            self._count('canary_fallbacks')
+            return None
+        self.canary_latency.add((time.perf_counter() - start) * 1000.0)
+        self._count('canary_served')
+        return result
+
+    def observe(self, data, primary_result, primary_ms, was_busy):
+        """Record a primary-served request and maybe enqueue it for shadow scoring"""
+        self.primary_latency.add(primary_ms)
+        (self.primary_latency_busy if was_busy else self.primary_latency_idle).add(primary_ms)
+
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        if time.monotonic() < self._paused_until:
+            self._count('paused_skips')
+            return
+
+        start = time.perf_counter()
+        try:
+            self._queue.put_nowait((dict(data), primary_result))
+            self._count('sampled')
+        except queue.Full:
+            self._count('dropped')
+        self.enqueue_latency.add((time.perf_counter() - start) * 1000.0)
+        self._check_budget()
+
+    def added_p99_ms(self):
+        """Estimated p99 added to primary requests by background candidate scoring"""
+        if len(self.primary_latency_busy) < self.min_samples or len(self.primary_latency_idle) < self.min_samples:
+            return None
+        return max(0.0, self.primary_latency_busy.percentile(99) - self.primary_latency_idle.percentile(99))
+
+    def _check_budget(self):
+        # Percentiles are not free, so evaluate the budget at most once per second
+        now = time.monotonic()
+        if now < self._next_budget_check:
+            return
+        self._next_budget_check = now + 1.0
+        added = self.added_p99_ms()
+        if added is not None and added > self.max_added_p99_ms:
+            self._paused_until = now + self.cooldown_seconds
+            # Re-measure from scratch after the cooldown instead of re-tripping on stale samples
+            self.primary_latency_busy.clear()
+            self._count('pauses')
+            print(f"⏸️ Shadow scoring paused for {self.cooldown_seconds:.0f}s: "
+                  f"added p99 {added:.2f} ms > budget {self.max_added_p99_ms:.2f} ms")
+
+    # ------------------------------------------------------------------
+    # Background scoring
+    # ------------------------------------------------------------------
+    def _worker_loop(self):
+        while True:
+            data, primary_result = self._queue.get()
+            self._busy.set()
+            try:
+                start = time.perf_counter()
+                candidate_result = self.candidate_fn(data)
+                candidate_ms = (time.perf_counter() - start) * 1000.0
+                self.candidate_latency.add(candidate_ms)
+                self._record_delta(primary_result, candidate_result, candidate_ms)
+            except Exception as e:
+                self._count('candidate_errors')
+                print(f"⚠️ Shadow candidate failed: {e}")
+            finally:
+                self._busy.clear()
+                self._queue.task_done()
+
+    def _record_delta(self, primary_result, candidate_result, candidate_ms):
+        primary = primary_result['ensemble_prediction']
+        candidate = candidate_result['ensemble_prediction']
+        delta = candidate - primary
+        with self._lock:
+            self._counts['compared'] += 1
+            self._delta['sum'] += delta
+            self._delta['sum_abs'] += abs(delta)
+            self._delta['sum_sq'] += delta * delta
+            self._delta['max_abs'] = max(self._delta['max_abs'], abs(delta))
+            primary_models = primary_result.get('individual_predictions', {})
+            for name, value in candidate_result.get('individual_predictions', {}).items():
+                if name in primary_models:
+                    stats = self._model_deltas.setdefault(name, {'count': 0, 'sum_abs': 0.0})
+                    stats['count'] += 1
+                    stats['sum_abs'] += abs(value - primary_models[name])
+        self.recent.append({
+            'timestamp': datetime.now().isoformat(),
+            'primary': primary,
+            'candidate': candidate,
+            'delta': round(delta, 4),
+            'candidate_ms': round(candidate_ms, 3)
+        })
+
+    def drain(self, timeout=5.0):
+        """Wait for queued shadow work (used by tooling, never on the request path)"""
+        deadline = time.monotonic() + timeout
+        while (self._queue.unfinished_tasks or self._busy.is_set()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def report(self):
+        with self._lock:
+            counts = dict(self._counts)
+            delta = dict(self._delta)
+            model_deltas = {
+                name: round(stats['sum_abs'] / stats['count'], 4)
+                for name, stats in self._model_deltas.items() if stats['count']
+            }
+        compared = counts['compared']
+        deltas = {'count': compared}
+        if compared:
+            mean = delta['sum'] / compared
+            deltas.update({
+                'mean': round(mean, 4),
+                'mean_abs': round(delta['sum_abs'] / compared, 4),
+                'rmse': round(float(np.sqrt(delta['sum_sq'] / compared)), 4),
+                'max_abs': round(delta['max_abs'], 4),
+                'per_model_mean_abs': model_deltas
+            })
+
+        added = self.added_p99_ms()
+        return {
+            'mode': self.mode,
+            'candidate': self.candidate_name,
+            'sample_rate': self.sample_rate,
+            'canary_percent': self.canary_percent,
+            'started_at': self.started_at,
+            'counts': counts,
+            'queue_depth': self._queue.qsize(),
+            'paused': time.monotonic() < self._paused_until,
+            'prediction_delta': deltas,
+            'latency': {
+                'primary': self.primary_latency.summary(),
+                'primary_while_shadow_busy': self.primary_latency_busy.summary(),
+                'primary_while_shadow_idle': self.primary_latency_idle.summary(),
+                'shadow_enqueue': self.enqueue_latency.summary(),
+                'candidate': self.candidate_latency.summary(),
+                'canary': self.canary_latency.summary(),
+                'added_p99_ms': None if added is None else round(added, 3),
+                'max_added_p99_ms': self.max_added_p99_ms
+            },
+            'recent': list(self.recent)[-10:]
+        }
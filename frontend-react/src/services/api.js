@@ -88,4 +88,60 @@ export const predictionService = {
   }
 };
 
+// Large scoring requests run as background jobs on the server. Status and
+// polling calls are quick and use the default 10s timeout; file uploads can
+// take much longer (the server stores the whole CSV before replying), so they
+// disable the timeout and report upload progress instead.
+export const jobService = {
+  async submitRows(rows) {
+    const response = await api.post('/api/jobs', { rows });
+    return response.data;
+  },
+
+  async submitFile(file, onUploadProgress) {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await api.post('/api/jobs', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      timeout: 0,
+      onUploadProgress: (event) => {
+        if (onUploadProgress && event.total) {
+          onUploadProgress(event.loaded / event.total);
+        }
+      },
+    });
+    return response.data;
+  },
+
+  async getJob(jobId) {
+    const response = await api.get(`/api/jobs/${jobId}`);
+    return response.data;
+  },
+
+  async cancelJob(jobId) {
+    const response = await api.delete(`/api/jobs/${jobId}`);
+    return response.data;
+  },
+
+  // Poll until the job finishes; onProgress receives each status update
+  async waitForJob(jobId, onProgress, intervalMs = 2000) {
+    for (;;) {
+      const job = await this.getJob(jobId);
+      if (onProgress) onProgress(job);
+      if (['completed', 'failed', 'cancelled'].includes(job.status)) {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  },
+
+  resultUrl(jobId) {
+    return `${API_BASE_URL}/api/jobs/${jobId}/result`;
+  },
+
+  eventsUrl(jobId) {
+    return `${API_BASE_URL}/api/jobs/${jobId}/events`;
+  }
+};
+
 export default api;
\ No newline at end of file